@@ -1,28 +1,22 @@
 from copy import copy
 from itertools import product
-from collections import defaultdict
 from pathlib import Path
 import warnings
-warnings.filterwarnings("error")
 
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from scipy.stats import ttest_ind
+from scipy.stats import t as t_dist
+from numba import njit
 from sklearn.pipeline import make_pipeline
 from sklearn.linear_model import LogisticRegression, LinearRegression
 from sklearn.preprocessing import StandardScaler
 from unsupervised_bias_detection.clustering import BiasAwareHierarchicalKMeans
 from sklearn.cluster import KMeans
-from sklearn.model_selection import train_test_split
 
 from joblib import Parallel, delayed
 import sys
 
-def set_seed(seed):
-    np.random.seed(seed)
-
-
 METRICS_BINARY = {
     'y_pred': lambda y, y_pred: y_pred,
     'fp': lambda y, y_pred: np.logical_and(y == 0, y_pred == 1).astype(int),
@@ -36,7 +30,7 @@ METRICS_CONTINUOUS = {
 }
 
 
-def simulate_synthetic_data( K, N, y_dgp, x_dgp, d, seed, binary_y=False):
+def simulate_synthetic_data( K, N, y_dgp, x_dgp, d, rng, binary_y=False):
 
     """
     Follows the DGP from Misztal-Radecka & Indurkhya
@@ -53,111 +47,95 @@ def simulate_synthetic_data( K, N, y_dgp, x_dgp, d, seed, binary_y=False):
             constant: M \sim N(0, 1) for all segments
             linear: M \sim N(0, 1) + 0.1 * k, e.g. an increasing trend per segment
         - x_dgp: str, one of the following options
-            constant: X \sim N(0, 1) for all segments
+            constant: X \sim N(0, I) for all segments
+            random: X \sim N(\mu_k, I) for all segments, with \mu_k sampled from [0  1]
+            (the covariance is the identity, so X is drawn as standard normal noise plus \mu_k)
         - d: int, number of features
             Standard is 2 from Misztal-Radecka & Indurkhya
-        - seed: int, seed for reproducibility
+        - rng: np.random.Generator (or int seed), for reproducibility
         - binary_y: bool, whether to make the target variable binary
 
     """
 
-    # before starting, set the seed
-    set_seed(seed)
+    # raise any warning while sampling the data (e.g. invalid DGP parameters) as an error -
+    # this is scoped to the DGP, so the rest of the experiment runs with the default filters
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+
+        # before starting, get the generator (a new one if rng is a seed)
+        rng = np.random.default_rng(rng)
 
     
-    # if K is random, sample uniformly from [2  10]
-    if K == 'random':
-        K = np.random.randint(2, 10)
+        # if K is random, sample uniformly from [2  10]
+        if K == 'random':
+            K = rng.integers(2, 10)
     
-    # if N_k is random, sample uniformly from [10  200] for each segment
-    if N == 'random':
-        N_k_values = np.random.randint(10, 200, K)
-    else:
-        N_k_values = [int(N/K)]*K
+        # if N_k is random, sample uniformly from [10  200] for each segment
+        if N == 'random':
+            N_k_values = rng.integers(10, 200, K)
+        else:
+            N_k_values = [int(N/K)]*K
     
-    # create matrix to store the data with shape (N, d+1, K)
-    data = np.zeros((np.sum(N_k_values), d+2))
-    i = 0
-
-    # loop over each segment
-    for k in range(K):
-        
-        # get the number of observations for this segment
-        n_k = N_k_values[k]
-
-        # update the index
-        i += n_k
+        # segment number of each observation, and the total number of observations
+        segment_ids = np.repeat(np.arange(K), N_k_values)
+        N_total = segment_ids.size
 
         ## Set the dgp for the target variable y - this is based on whether or not the target variable is binary
         # For a continuous target variable, we sample mu_k, sigma_k from [0  1] and sample from N(mu_k, sigma_k)
         if not binary_y:
-            # If random, sample mu_k, sigma_k from [0  1], and sample from N(mu_k, sigma_k)
+            # If random, sample mu_k, sigma_k from [0  1] for each segment, and sample from N(mu_k, sigma_k)
             if y_dgp == 'random':
-                mu_k, sigma_k = np.random.uniform(0, 1, 2)
-        
+                mu_per_k, sigma_per_k = rng.uniform(0, 1, (2, K))
+
             # If constant, set mu_k as 0, sigma_k as 1, and sample from N(0, 1)
             elif y_dgp == 'constant':
-                mu_k, sigma_k = 0, 1
-            
+                mu_per_k, sigma_per_k = np.zeros(K), np.ones(K)
+
             # If linear, set mu_k between -1 and 1, and increase linearly with k
             elif y_dgp == 'linear':
 
                 # set sigma_k as 1
-                sigma_k = 1
+                sigma_per_k = np.ones(K)
 
                 # increase linearly with k
-                mu_k = -1 + (2 * k / (K-1))
-                
+                mu_per_k = -1 + (2 * np.arange(K) / (K-1))
 
-            # now generate the target variable y from N(mu_k, sigma_k)
-            y_k = np.random.normal(mu_k, sigma_k, n_k)
+            # now generate the target variable y from N(mu_k, sigma_k), for all segments at once
+            eps = rng.standard_normal(N_total)
+            y = mu_per_k[segment_ids] + sigma_per_k[segment_ids] * eps
         else:
-            
+
             # If binary, and random, sample mu_k from [0  1], and set the probability of y=1 as mu_k
             if y_dgp == 'random':
-                p_k = np.random.uniform(0, 1, 1)
+                p_per_k = rng.uniform(0, 1, K)
 
             # If binary, and constant, set mu_k as 0.5
             elif y_dgp == 'constant':
-                p_k = 0.5
+                p_per_k = np.full(K, 0.5)
 
             # If binary, and linear, set mu_k between 0.1 and 0.9, and increase linearly with k
             elif y_dgp == 'linear':
-                p_k = 0.1 + 0.8 * k / (K-1)
-            
-            # generate the binary target variable y from a binomial distribution with probability p_k
-            y_k = np.random.binomial(1, p_k, n_k)        
+                p_per_k = 0.1 + 0.8 * np.arange(K) / (K-1)
 
-        # if binary_y is True, then make the target variable binary
-        if binary_y:
-            y_k = np.where(y_k > 0.5, 1, 0)
+            # generate the binary target variable y from a bernoulli distribution with probability p_k
+            y = (rng.random(N_total) < p_per_k[segment_ids]).astype(int)
 
         # then, define the DGP for the features X
         if x_dgp == 'constant':
-            mu_k_x = np.zeros(d)
-            sigma_k_x = np.eye(d)
+            mu_per_k_x = np.zeros(K)
         elif x_dgp == 'random':
 
-            # sample mu from [0  1]
-            mu = np.random.uniform(0, 1, 1)
-            mu_k_x = np.ones(d) * mu
-
-            # set the covariance matrix as the identity
-            sigma_k_x = np.eye(d) 
-
-        
-        # generate the features as a matrix X
-        X_k = np.random.multivariate_normal(mu_k_x, sigma_k_x, n_k)
-
-        # create an entry to the matrix
-        entry = np.zeros((n_k, d+2))
-        entry[:, 0] = y_k # first column is the target variable
-        entry[:, 1:-1] = X_k # up until the last column are the features
-        entry[:, -1] = k # last column is the segment number
+            # sample mu from [0  1] for each segment
+            mu_per_k_x = rng.uniform(0, 1, K)
 
-        # save the entry in the data matrix
-        data[i-n_k:i, :] = entry
+        # generate the features as a matrix X - the covariance matrix is the identity
+        X = rng.standard_normal((N_total, d)) + mu_per_k_x[segment_ids, None]
 
+        # create matrix to store the data with shape (N, d+2)
+        data = np.zeros((N_total, d+2))
+        data[:, 0] = y # first column is the target variable
+        data[:, 1:-1] = X # up until the last column are the features
+        data[:, -1] = segment_ids # last column is the segment number
 
     # save the information in a dictionary
     sim_dict = {
@@ -171,6 +149,56 @@ def simulate_synthetic_data( K, N, y_dgp, x_dgp, d, seed, binary_y=False):
 
     return sim_dict
 
+def standardize(X_train, X_val):
+    """
+    Standardize the features of the training and validation set, with the mean/std of the training set
+    (equivalent to StandardScaler, without the overhead of a pipeline per experiment)
+
+    Args:
+        X_train: np.array, shape (N, d)
+        X_val: np.array, shape (N, d), may be X_train itself (fit_train=False)
+    """
+    mu = X_train.mean(axis=0)
+    sigma = X_train.std(axis=0)
+
+    # as in StandardScaler, do not scale features with zero variance
+    sigma[sigma == 0] = 1
+
+    X_train_s = (X_train - mu) / sigma
+
+    # if the train and val set are the same data, standardize it only once
+    if X_val is X_train:
+        return X_train_s, X_train_s
+
+    return X_train_s, (X_val - mu) / sigma
+
+def stratified_split(k, val_frac, rng):
+    """
+    Split the observations in a train and val set, stratified per segment
+    (shuffles the observations within each segment, and puts the first val_frac of them in the val set)
+
+    Args:
+        k: np.array, shape (N,), the segment number of each observation
+        val_frac: float, fraction of data to use for validation
+        rng: np.random.Generator (or int seed), for reproducibility
+    """
+    rng = np.random.default_rng(rng)
+
+    # group the observations per segment with a single sort
+    segments = k.astype(int)
+    order = np.argsort(segments, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(segments))])
+
+    # shuffle each segment, and split it in a val and train part
+    train_idx, val_idx = [], []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        idx_k = order[start:end][rng.permutation(end - start)]
+        n_val = int((end - start) * val_frac)
+        val_idx.append(idx_k[:n_val])
+        train_idx.append(idx_k[n_val:])
+
+    return np.concatenate(train_idx), np.concatenate(val_idx)
+
 def simulate_hbac(method,  K, N, y_dgp, x_dgp,  d, seed, binary_y=False, fit_train=True, target_col='y_pred', n_iter_hbac='known_clusters', min_cluster_size=5, val_frac=0.5):
     """
     Simulates the synthetic data, fits the clustering method, and returns the results
@@ -221,15 +249,19 @@ def simulate_hbac(method,  K, N, y_dgp, x_dgp,  d, seed, binary_y=False, fit_tra
     if fit_train and N != 'random':
         N = int(N / val_frac)
 
+    # a single generator for all random draws of this experiment
+    rng = np.random.default_rng(seed)
+
     # simulate the synthetic data
-    result_sim = simulate_synthetic_data(K, N, y_dgp, x_dgp, d, seed, binary_y=binary_y)
+    result_sim = simulate_synthetic_data(K, N, y_dgp, x_dgp, d, rng, binary_y=binary_y)
     X = result_sim['data'][:, 1:-1]
     y = result_sim['data'][:, 0].flatten()
     k = result_sim['data'][: , -1].flatten()
 
     # Split in train and val set
     if fit_train:
-        X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=val_frac, stratify=k, random_state=seed)
+        train_idx, val_idx = stratified_split(k, val_frac, rng)
+        X_train, X_val, y_train, y_val = X[train_idx], X[val_idx], y[train_idx], y[val_idx]
     else:
         X_train, X_val, y_train, y_val = X, X, y, y # in this case, we use all the data for training/testing
 
@@ -242,16 +274,21 @@ def simulate_hbac(method,  K, N, y_dgp, x_dgp,  d, seed, binary_y=False, fit_tra
 
     else:
 
+        # standardize the features with the mean/std of the training set
+        X_train_s, X_val_s = standardize(X_train, X_val)
+
         # define the model
         if binary_y:
-            model = make_pipeline(StandardScaler(), LogisticRegression())
+            model = LogisticRegression()
         else:
-            model = make_pipeline(StandardScaler(), LinearRegression())
+            model = LinearRegression()
         
         # Fit the model on the training set
-        model.fit(X_train, y_train)
-        y_pred_val = model.predict(X_val) # predicted labels on the validation set
-        y_pred_train = model.predict(X_train) # predicted labels on the training set
+        model.fit(X_train_s, y_train)
+        y_pred_val = model.predict(X_val_s) # predicted labels on the validation set
+
+        # predicted labels on the training set (the same as on the validation set, if these are the same data)
+        y_pred_train = y_pred_val if X_val_s is X_train_s else model.predict(X_train_s)
     
         # if binary_y is True, then define target via binary metrics
         if binary_y:
@@ -265,16 +302,14 @@ def simulate_hbac(method,  K, N, y_dgp, x_dgp,  d, seed, binary_y=False, fit_tra
     # obtain cluster labels
     if method in ['kmeans', 'kmeans_cv']:
 
-        # define the cluster model
-        set_seed(seed)
-
         # if n_iter_hbac is 'known_clusters', use the number of known clusters
         if n_iter_hbac == 'known_clusters':
             n_iter_kmeans = result_sim['K']
         else:
             n_iter_kmeans = K
         
-        cluster_model = KMeans(n_clusters=n_iter_kmeans)
+        # define the cluster model
+        cluster_model = KMeans(n_clusters=n_iter_kmeans, random_state=seed)
         cluster_model.fit(X_train)
 
         # fit the model on the training set
@@ -285,13 +320,12 @@ def simulate_hbac(method,  K, N, y_dgp, x_dgp,  d, seed, binary_y=False, fit_tra
     
     # if method is hbac, use the BiasAwareHierarchicalKMeans
     elif method == 'hbac':
-        set_seed(seed)
 
         # if n_iter_hbac is 'known_clusters', use the number of known clusters
         if n_iter_hbac == 'known_clusters':
             n_iter_hbac = result_sim['K']-1
         
-        hbac = BiasAwareHierarchicalKMeans(n_iter=n_iter_hbac, min_cluster_size=min_cluster_size) # 5 is the minimum
+        hbac = BiasAwareHierarchicalKMeans(n_iter=n_iter_hbac, min_cluster_size=min_cluster_size, random_state=seed) # 5 is the minimum
 
         # Fit on training set
         hbac.fit(X_train, m_train)
@@ -306,7 +340,7 @@ def simulate_hbac(method,  K, N, y_dgp, x_dgp,  d, seed, binary_y=False, fit_tra
     # if method is randomclusters, randomly assign cluster labels
     elif method == 'randomclusters':
         K_for_random = result_sim['K']
-        labels = np.random.choice(range(K_for_random), size=X_val.shape[0])
+        labels = rng.integers(0, K_for_random, size=X_val.shape[0])
     else:
         raise ValueError(f"Not a known method ({method})")
     
@@ -314,23 +348,88 @@ def simulate_hbac(method,  K, N, y_dgp, x_dgp,  d, seed, binary_y=False, fit_tra
     return X_val, X_train, m_val, m_train, labels, y_val, y_train
 
 
-def check_before_test(c0, c1, min_samples=5):
-    """Determines whether to do significance testing
-    (don't do this with too few observations/constant data to avoid NaNs)."""
-    if (c0.size < min_samples) or (c1.size < min_samples):
-        return True
+def moment_sums(A):
+    """
+    Return the number of observations, and the (column) sums and sums of squares of A
 
-    if np.mean(c0) == np.mean(c1):
-        return True
-    
-    if np.all(c0 == c0[0]) or np.all(c1 == c1[0]):
-        return True
+    Args:
+        A: np.array, shape (N,) or (N, d)
+    """
+    return A.shape[0], A.sum(axis=0), (A * A).sum(axis=0)
+
+
+def split_moments(A_1, totals):
+    """
+    Return the size, mean and variance (ddof=1) of cluster 1 and cluster 0, where cluster 0 is derived
+    from the moment sums over all observations - so that the complement of the cluster is never scanned
+
+    Args:
+        A_1: np.array, shape (N_1,) or (N_1, d), the observations in cluster 1
+        totals: tuple, the output of moment_sums over all observations
+    """
+    n, sum_all, sumsq_all = totals
+    n1, sum1, sumsq1 = moment_sums(A_1)
+    n0, sum0, sumsq0 = n - n1, sum_all - sum1, sumsq_all - sumsq1
+
+    # for too small clusters, these are nan and the cluster is skipped by simulate_experiment
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m1, m0 = sum1 / n1, sum0 / n0
+        v1 = np.maximum(sumsq1 - sum1 * m1, 0) / (n1 - 1)
+        v0 = np.maximum(sumsq0 - sum0 * m0, 0) / (n0 - 1)
 
-    return False
+    return n1, m1, v1, n0, m0, v0
 
 
+@njit(fastmath=True, cache=True)
+def feature_t_stats(X_1, n, sum_all, sumsq_all, const_all):
+    """
+    Return the t-statistics (pooled variance, as ttest_ind does by default) and differences in means
+    of all features between cluster 1 and cluster 0, in a single pass over the observations in cluster 1.
+    Features with constant data/equal means are skipped: constant data in cluster 1/all observations is
+    checked exactly, and a variance below a tolerance (relative to the second moment) counts as zero.
 
-def null_X_y(X_train, X_val, y_train, y_val, n_perm=1000, perm=True):
+    Args:
+        X_1: np.array, shape (N_1, d), the features of the observations in cluster 1
+        n: int, the number of observations
+        sum_all: np.array, shape (d,), the column sums over all observations
+        sumsq_all: np.array, shape (d,), the column sums of squares over all observations
+        const_all: np.array, shape (d,), whether each column is constant over all observations
+    """
+    n1, d = X_1.shape
+    n0 = n - n1
+
+    # accumulate the column sums/sums of squares of cluster 1 row by row, and check which columns are constant
+    sum1 = np.zeros(d)
+    sumsq1 = np.zeros(d)
+    const1 = np.ones(d, dtype=np.bool_)
+    for i in range(n1):
+        for j in range(d):
+            x = X_1[i, j]
+            sum1[j] += x
+            sumsq1[j] += x * x
+            if x != X_1[0, j]:
+                const1[j] = False
+
+    # derive the statistics of cluster 0 from the totals, and compute the t-statistic per feature
+    t = np.zeros(d)
+    diff = np.zeros(d)
+    keep = np.zeros(d, dtype=np.bool_)
+    for j in range(d):
+        sum0 = sum_all[j] - sum1[j]
+        m1, m0 = sum1[j] / n1, sum0 / n0
+        v1 = max(sumsq1[j] - sum1[j] * m1, 0.0) / (n1 - 1)
+        v0 = max(sumsq_all[j] - sumsq1[j] - sum0 * m0, 0.0) / (n0 - 1)
+        tol = 1e-12 * sumsq_all[j] / n
+        if not (const1[j] or const_all[j]) and v1 > tol and v0 > tol and m1 != m0:
+            keep[j] = True
+            var_pooled = ((n1 - 1) * v1 + (n0 - 1) * v0) / (n - 2)
+            t[j] = (m1 - m0) / np.sqrt(var_pooled * (1 / n1 + 1 / n0))
+            diff[j] = m1 - m0
+
+    return t[keep], diff[keep]
+
+
+def null_X_y(X_train, X_val, y_train, y_val, n_perm=1000, perm=True, rng=None):
     """
     Return n_perm pairs of (X, y_perm) where y_perm is a permutation of y
 
@@ -339,14 +438,16 @@ def null_X_y(X_train, X_val, y_train, y_val, n_perm=1000, perm=True):
         X_val: np.array, shape (N, d)
         y_train: np.array, shape (N,)
         y_val: np.array, shape (N,)
+        rng: np.random.Generator (or int seed), for the permutations
     """
+    rng = np.random.default_rng(rng)
     null_X_y = []
     for i in range(n_perm):
 
         # permute the y values if perm is True
         if perm:
-            y_train_perm = np.random.permutation(y_train)
-            y_val_perm = np.random.permutation(y_val)
+            y_train_perm = rng.permutation(y_train)
+            y_val_perm = rng.permutation(y_val)
         else:
             y_train_perm = y_train
             y_val_perm = y_val
@@ -368,11 +469,8 @@ def fit_hbac(X_train, y_train, n_iter_hbac, min_cluster_size, seed):
         min_cluster_size: int, minimum cluster size
         seed: int, random seed
     """
-    # set the seed
-    set_seed(seed)
-
     # Initialize the HBAC model
-    hbac = BiasAwareHierarchicalKMeans(n_iter=n_iter_hbac, min_cluster_size=min_cluster_size) 
+    hbac = BiasAwareHierarchicalKMeans(n_iter=n_iter_hbac, min_cluster_size=min_cluster_size, random_state=seed) 
 
     # Fit on training set
     hbac.fit(X_train, y_train)
@@ -397,9 +495,6 @@ def compute_diff_hbac(X_train, X_val, y_train, y_val, max_k, n_iter_hbac, min_cl
         seed: int, random seed
         fit_train: bool, whether to fit on a train set and predict on a validation set
     """
-    # set the seed
-    set_seed(seed)
-
     # define the model
     if target_col == 'y':
         m_train = y_train
@@ -477,8 +572,11 @@ def compute_diff_per_perm(n_perm, X_train, X_val, y_train, y_val, max_k, n_iter_
     diffs_perm = np.full((n_perm, max_k), np.nan)
     i=0
 
+    # the permutations get their own stream, separate from the one of the DGP (default_rng(seed))
+    rng = np.random.default_rng([seed, 1])
+
     # loop over each permutation
-    for X_train_perm, X_val_perm, y_train_perm, y_val_perm in null_X_y(X_train, X_val, y_train, y_val, n_perm=n_perm, perm=True):
+    for X_train_perm, X_val_perm, y_train_perm, y_val_perm in null_X_y(X_train, X_val, y_train, y_val, n_perm=n_perm, perm=True, rng=rng):
         diff_i = compute_diff_hbac(X_train_perm, X_val_perm, y_train_perm, y_val_perm, max_k, n_iter_hbac, min_cluster_size, seed, fit_train=fit_train, target_col=target_col)
         diffs_perm[i] = diff_i
         i += 1
@@ -511,48 +609,45 @@ def calc_p_value(diffs, diff, alternative='two-sided'):
     return p_value
 
 
-def compute_statistics(X, target, idx, bonf_correct, n_clust, bootstrap_perm, diffs_perm=None):
-    """Compute statistics for each cluster/feature."""
-    c1, c0 = target[idx], target[~idx]
+def compute_statistics(X_1, X_totals, X_const, target_stats, bonf_correct, n_clust, bootstrap_perm, diffs_perm=None):
+    """
+    Compute statistics for each cluster/feature.
 
-    # if bootstrap_perm is True, calculate the diff and check the p-value via the null distribution
-    if bootstrap_perm:
+    Args:
+        X_1: np.array, shape (N_1, d), the (shifted) features of the observations in the cluster
+        X_totals: tuple, the output of moment_sums over the (shifted) features of all observations
+        X_const: np.array, shape (d,), whether each feature is constant over all observations
+        target_stats: tuple, the output of split_moments for the target
+    """
+    n1, m1, v1, n0, m0, v0 = target_stats
+    diff_clust = m1 - m0 # Difference in means
 
-        # calculate the difference in means
-        diff =  c1.mean() - c0.mean()
+    # if bootstrap_perm is True, check the p-value of the diff via the null distribution
+    if bootstrap_perm:
 
         # calculate the p-value
-        p_clust = calc_p_value(diffs_perm, diff)
+        p_clust = calc_p_value(diffs_perm, diff_clust)
     
     else:
-        # calculate the p-value using a t-test
-        _, p_clust = ttest_ind(c1, c0, equal_var=False) 
+        # calculate the p-value using a t-test (Welch, unequal variances)
+        se1, se0 = v1 / n1, v0 / n0
+        t = diff_clust / np.sqrt(se1 + se0)
+        df = (se1 + se0)**2 / (se1**2 / (n1 - 1) + se0**2 / (n0 - 1))
+        p_clust = 2 * t_dist.sf(np.abs(t), df)
     
     # apply bonferroni correction
     if bonf_correct:
         p_clust = p_clust * n_clust # Bonferroni correction - multiply by number of clusters
 
-    diff_clust = c1.mean() - c0.mean() # Difference in means
-    
-    p_feat, diff_feat = [], []
-    for ii in range(X.shape[1]):
-        X_ = X[:, ii]
-        c1, c0 = X_[idx], X_[~idx]
+    # test all features at once: the t-statistics are computed in a compiled kernel,
+    # the p-values in a single vectorized call
+    n, sum_all, sumsq_all = X_totals
+    t, diff_feat = feature_t_stats(X_1, n, sum_all, sumsq_all, X_const)
+    p_feat = 2 * t_dist.sf(np.abs(t), n - 2)
 
-        should_continue = check_before_test(c0, c1)
-        if should_continue:
-            continue
-        
-        # calculate the p-value using a t-test
-        _, p = ttest_ind(c1, c0)
-        
-        # if bonf_correct is True, multiply the p-value by the number of features
-        if bonf_correct:
-            p = p * X.shape[1]
-
-        p_feat.append(p)
-        diff = c1.mean() - c0.mean()
-        diff_feat.append(diff)
+    # if bonf_correct is True, multiply the p-value by the number of features
+    if bonf_correct:
+        p_feat = p_feat * X_1.shape[1]
 
     return p_clust, diff_clust, p_feat, diff_feat
 
@@ -560,17 +655,22 @@ def compute_statistics(X, target, idx, bonf_correct, n_clust, bootstrap_perm, di
 def simulate_n_experiments(n_sims, parallel, method, K, N, y_dgp, x_dgp,  d, binary_y=False, fit_train=True, n_iter_hbac=10, min_cluster_size=5, val_frac=0.5, bonf_correct=True, target_col='y', bootstrap_perm=False, n_perm=1000, n_jobs=4):
     # if parallel is True, run the experiments in parallel
     if parallel: 
-        results = Parallel(n_jobs=n_jobs)(delayed(simulate_experiment)(method, K, N, y_dgp, x_dgp,  d, seed=i, binary_y=binary_y, fit_train=fit_train, n_iter_hbac=n_iter_hbac, min_cluster_size=min_cluster_size, val_frac=val_frac, bonf_correct=bonf_correct, target_col=target_col, bootstrap_perm=bootstrap_perm, n_perm=n_perm) for i in range(n_sims))
+
+        # each experiment is short, so send the seeds to the workers in batches (~4 per worker)
+        # to amortize the dispatch and the pickling of the results
+        batch_size = max(1, n_sims // (4 * n_jobs))
+        results = Parallel(n_jobs=n_jobs, backend='loky', batch_size=batch_size, pre_dispatch='2*n_jobs')(delayed(simulate_experiment)(method, K, N, y_dgp, x_dgp,  d, seed=i, binary_y=binary_y, fit_train=fit_train, n_iter_hbac=n_iter_hbac, min_cluster_size=min_cluster_size, val_frac=val_frac, bonf_correct=bonf_correct, target_col=target_col, bootstrap_perm=bootstrap_perm, n_perm=n_perm) for i in range(n_sims))
     
     # otherwise, run the experiments sequentially
     else:
         results = [simulate_experiment(method, K, N, y_dgp, x_dgp,  d, seed=i, binary_y=binary_y, fit_train=fit_train, n_iter_hbac=n_iter_hbac, min_cluster_size=min_cluster_size, val_frac=val_frac, bonf_correct=bonf_correct, target_col=target_col) for i in range(n_sims)]
     
 
-    # combine the results in a dataframe
-    results_clust = pd.concat([r[0] for r in results if r is not None], axis=0)
-    results_feat = pd.concat([r[1] for r in results if r is not None], axis=0)
-    avg_missing = np.mean([r[2] for r in results if r is not None])
+    # combine the results in a dataframe, concatenating the columns of all experiments first
+    results = [r for r in results if r is not None]
+    results_clust = pd.DataFrame({col: np.concatenate([r[0][col] for r in results]) for col in results[0][0]})
+    results_feat = pd.DataFrame({col: np.concatenate([r[1][col] for r in results]) for col in results[0][1]})
+    avg_missing = np.mean([r[2] for r in results])
     print('Avg. number of clusters skipped per experiment: {}'.format(avg_missing))
 
     return results_clust, results_feat
@@ -601,16 +701,31 @@ def simulate_experiment(method, K, N, y_dgp, x_dgp,  d, seed, binary_y=False, fi
     if X_val.shape[0] <= 5:
         return None
     
+    # group the observations per cluster with a single sort: the observations of cluster l
+    # are order[bounds[l]:bounds[l+1]], and only the clusters with observations are counted
+    order = np.argsort(labels, kind='stable')
+    counts = np.bincount(labels)
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+
     # define the results
-    n_clust = np.unique(labels).size
-    results_clust = defaultdict(list)
-    results_feat = defaultdict(list)
+    n_clust = np.count_nonzero(counts)
+
+    # preallocate the results for at most n_clust clusters, and n_clust * d features
+    cluster_nr_arr = np.empty(n_clust, dtype=np.int64)
+    p_clust_arr = np.empty(n_clust)
+    diff_clust_arr = np.empty(n_clust)
+    size_clust_arr = np.empty(n_clust, dtype=np.int64)
+    n_feat = X_val.shape[1]
+    feat_nr_arr = np.empty(n_clust * n_feat, dtype=np.int64)
+    p_feat_arr = np.empty(n_clust * n_feat)
+    diff_feat_arr = np.empty(n_clust * n_feat)
+    size_feat_arr = np.empty(n_clust * n_feat, dtype=np.int64)
 
     # get the N total
     N = X_train.shape[0]
 
     # define the parameters to save
-    params_ = list(zip(
+    params_ = dict(zip(
         ['method', 'target_col', 'K', 'N', 'y_dgp', 'x_dgp', 'd', 'binary_y',  'fit_train', 'n_iter_hbac', 'min_cluster_size', 'val_frac', 'bonf_correct', 'bootstrap_perm', 'n_perm'],
         [method, target_col, K, N, y_dgp, x_dgp, d, binary_y, fit_train, n_iter_hbac, min_cluster_size, val_frac, bonf_correct, bootstrap_perm, n_perm]
     ))
@@ -626,48 +741,78 @@ def simulate_experiment(method, K, N, y_dgp, x_dgp,  d, seed, binary_y=False, fi
     else:
         diffs_perm = None
 
-    # loop over each cluster
-    count_missing = 0
-    for l in np.unique(labels):
+    # shift the target/features by their first observation, so that the moment sums do not lose precision
+    # for data with a large offset (a shift within the range of the data works as well as the mean for this,
+    # and keeps integer-valued data such as binary metrics exact); differences/variances are unaffected
+    target_s = target - target[0]
+    X_s = X_val - X_val[0]
 
-        # define cluster 1 (with label) and cluster 0 (~label)
-        idx = labels == l
-        c1, c0 = target[idx], target[~idx]
+    # compute the moment sums of the target/features over all observations once,
+    # the statistics of the complement of each cluster are derived from these
+    target_totals = moment_sums(target_s)
+    X_totals = moment_sums(X_s)
 
-        should_continue = check_before_test(c0, c1)
+    # the features that are constant over all observations are never tested
+    X_const = np.all(X_s == 0, axis=0)
+
+    # variances below this tolerance (relative to the second moment of the target) are treated as zero
+    target_tol = 1e-12 * target_totals[2] / target_totals[0]
+
+    # loop over each cluster, keeping track of the number of clusters/features saved
+    count_missing = 0
+    i_clust, i_feat = 0, 0
+    for l in np.flatnonzero(counts):
 
-        if should_continue:
+        # define cluster 1 (with label) and cluster 0 (~label)
+        idx = order[bounds[l]:bounds[l+1]]
+        target_1 = target_s[idx]
+        target_stats = split_moments(target_1, target_totals)
+        n1, m1, v1, n0, m0, v0 = target_stats
+
+        # don't do significance testing with too few observations/constant data/equal means, to avoid NaNs -
+        # the cluster itself is checked for constant data exactly, its complement via the tolerance
+        if n1 < 5 or n0 < 5 or m1 == m0 or np.all(target_1 == target_1[0]) or v1 <= target_tol or v0 <= target_tol:
             count_missing += 1
             continue
   
 
         # compute the statistics for each cluster/feature
-        p_clust, diff_clust, p_feat, diff_feat = compute_statistics(X_val, target, idx, bonf_correct, n_clust, bootstrap_perm, diffs_perm[ :, l] if bootstrap_perm else None)
-        results_clust['iter'].append(seed)
-        results_clust['cluster_nr'].append(l)
-        results_clust['p_clust'].append(p_clust)
-        results_clust['diff_clust'].append(diff_clust)
-        results_clust['size_clust'].append(idx.sum())
-
+        p_clust, diff_clust, p_feat, diff_feat = compute_statistics(X_s[idx], X_totals, X_const, target_stats, bonf_correct, n_clust, bootstrap_perm, diffs_perm[ :, l] if bootstrap_perm else None)
 
-        # save the results in the dictionary
-        for p_name_, p_ in params_:
-            results_clust[p_name_].append(p_)
+        # save the cluster stats
+        cluster_nr_arr[i_clust] = l
+        p_clust_arr[i_clust] = p_clust
+        diff_clust_arr[i_clust] = diff_clust
+        size_clust_arr[i_clust] = idx.size
+        i_clust += 1
 
         # save the feature stats separately
-        for i_feat, (p_feat_, diff_feat_) in enumerate(zip(p_feat, diff_feat)):
-            results_feat['feat_nr'].append(i_feat)
-            results_feat['p_feat'].append(p_feat_)
-            results_feat['diff_feat'].append(diff_feat_)
-            results_feat['size_feat'].append(idx.sum())
-
-            for p_name, p_ in params_:
-                results_feat[p_name].append(p_)
+        n_feat_l = len(p_feat)
+        feat_nr_arr[i_feat:i_feat + n_feat_l] = np.arange(n_feat_l)
+        p_feat_arr[i_feat:i_feat + n_feat_l] = p_feat
+        diff_feat_arr[i_feat:i_feat + n_feat_l] = diff_feat
+        size_feat_arr[i_feat:i_feat + n_feat_l] = idx.size
+        i_feat += n_feat_l
 
     
-    # save the results in a dataframe
-    results_clust = pd.DataFrame(results_clust)
-    results_feat = pd.DataFrame(results_feat)
+    # save the results as columns (dictionaries of arrays), with the parameters as constant columns -
+    # simulate_n_experiments combines the columns of all experiments in a single dataframe
+    results_clust = {
+        'iter': np.full(i_clust, seed),
+        'cluster_nr': cluster_nr_arr[:i_clust],
+        'p_clust': p_clust_arr[:i_clust],
+        'diff_clust': diff_clust_arr[:i_clust],
+        'size_clust': size_clust_arr[:i_clust],
+    }
+    results_feat = {
+        'feat_nr': feat_nr_arr[:i_feat],
+        'p_feat': p_feat_arr[:i_feat],
+        'diff_feat': diff_feat_arr[:i_feat],
+        'size_feat': size_feat_arr[:i_feat],
+    }
+    for p_name, p_ in params_.items():
+        results_clust[p_name] = np.full(i_clust, p_)
+        results_feat[p_name] = np.full(i_feat, p_)
 
     return results_clust, results_feat, count_missing
 
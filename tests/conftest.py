@@ -0,0 +1,10 @@
+"""Makes the scripts in paper_analysis importable for the tests.
+
+paper_analysis is a directory of scripts rather than a package, so its modules,
+e.g. run_experiment, are imported as top-level modules. Their dependencies
+(numba, tqdm, scipy) are listed in the dev dependencies in pyproject.toml.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "paper_analysis"))
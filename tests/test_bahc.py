@@ -29,4 +29,52 @@ def test_biases():
     y = rng.rand(20)
     hbac = BiasAwareHierarchicalKMeans(n_iter=5, min_cluster_size=2)
     hbac.fit(X, y)
-    assert np.all(hbac.scores_[:-1] >= hbac.scores_[1:])
\ No newline at end of file
+    assert np.all(hbac.scores_[:-1] >= hbac.scores_[1:])
+
+def test_predict():
+    # Checks that points are assigned to their closest centroid, also for features with a large offset
+    for offset in [0, 1e7]:
+        rng = np.random.RandomState(12)
+        X = offset + rng.rand(20, 10)
+        y = rng.rand(20)
+        hbac = BiasAwareHierarchicalKMeans(n_iter=5, min_cluster_size=2)
+        hbac.fit(X, y)
+        X_new = offset + rng.rand(3000, 10)
+        distances = ((X_new[:, :, None] - hbac.centroids_[None, :, :]) ** 2).sum(axis=1)
+        assert np.array_equal(hbac.predict(X_new), np.argmin(distances, axis=1))
+
+
+def test_float32():
+    # Checks that float32 data gives the same clusters, with scores accumulated in float64
+    rng = np.random.RandomState(12)
+    X = np.concatenate([rng.rand(10, 2), rng.rand(10, 2) + 10])
+    y = np.concatenate([rng.rand(10), rng.rand(10) + 10])
+    hbac32 = BiasAwareHierarchicalKMeans(n_iter=1, min_cluster_size=2, random_state=12)
+    hbac32.fit(X.astype(np.float32), y.astype(np.float32))
+    hbac64 = BiasAwareHierarchicalKMeans(n_iter=1, min_cluster_size=2, random_state=12)
+    hbac64.fit(X, y)
+    assert np.array_equal(hbac32.labels_, hbac64.labels_)
+    assert hbac32.scores_.dtype == np.float64
+    assert np.allclose(hbac32.scores_, hbac64.scores_, rtol=1e-6)
+
+
+def test_integer_X_keeps_y_precision():
+    # Checks that integer data, which is validated to float32, does not downcast a float64 y
+    X = np.array([[1, 2], [1, 4], [1, 0], [10, 2], [10, 4], [10, 0]])
+    y = 1e6 + np.array([0, 0, 0, 0.01, 0.01, 0.01])
+    hbac = BiasAwareHierarchicalKMeans(n_iter=1, min_cluster_size=1, random_state=12)
+    hbac.fit(X, y)
+    assert np.allclose(hbac.scores_, [0.01, -0.01])
+
+
+def test_large_offset():
+    # Checks that a large offset of y does not change the order of splits, nor the scores
+    rng = np.random.RandomState(12)
+    X = rng.rand(500, 3)
+    y = rng.rand(500)
+    hbac = BiasAwareHierarchicalKMeans(n_iter=10, min_cluster_size=10, random_state=12)
+    hbac.fit(X, y)
+    hbac_offset = BiasAwareHierarchicalKMeans(n_iter=10, min_cluster_size=10, random_state=12)
+    hbac_offset.fit(X, 1e7 + y)
+    assert np.array_equal(hbac.labels_, hbac_offset.labels_)
+    assert np.allclose(hbac.scores_, hbac_offset.scores_, atol=1e-6)
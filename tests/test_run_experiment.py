@@ -0,0 +1,45 @@
+"""Provides tests for the significance testing in paper_analysis/run_experiment.py.
+
+paper_analysis is not part of the package; tests/conftest.py puts it on the import path,
+and its dependencies are part of the dev dependencies.
+"""
+import numpy as np
+from scipy.stats import ttest_ind
+
+from run_experiment import feature_t_stats, moment_sums, split_moments
+
+
+def test_t_stats_large_offset():
+    """The t-tests are computed on shifted data, so they match ttest_ind for data with a large offset."""
+    rng = np.random.RandomState(12)
+    X = 1e4 + 1e-3 * rng.randn(200, 3)
+    idx = np.arange(60)
+    X_s = X - X[0]
+    n, sum_all, sumsq_all = moment_sums(X_s)
+    t, diff = feature_t_stats(X_s[idx], n, sum_all, sumsq_all, np.zeros(3, dtype=bool))
+    t_ref, _ = ttest_ind(X[idx], X[60:])
+    assert np.allclose(t, t_ref, rtol=1e-6)
+    assert np.allclose(diff, X[idx].mean(axis=0) - X[60:].mean(axis=0), rtol=1e-6)
+
+    y_s = X_s[:, 0]
+    n1, m1, v1, n0, m0, v0 = split_moments(y_s[idx], moment_sums(y_s))
+    assert np.isclose(v1, X[idx, 0].var(ddof=1), rtol=1e-6)
+    assert np.isclose(v0, X[60:, 0].var(ddof=1), rtol=1e-6)
+
+
+def test_t_stats_skip_constant_feature():
+    """Constant features are skipped, also when their computed variance is not exactly zero."""
+    rng = np.random.RandomState(12)
+    X = rng.randn(200, 3)
+    X[:, 1] = 0.1
+    X[60:, 2] = 1 / 3
+    idx = np.arange(60)
+    n, sum_all, sumsq_all = moment_sums(X)
+    const_all = np.all(X == X[0], axis=0)
+    t, diff = feature_t_stats(X[idx], n, sum_all, sumsq_all, const_all)
+    t_ref, _ = ttest_ind(X[idx, :1], X[60:, :1])
+    assert np.allclose(t, t_ref)
+
+    # the constant columns are also skipped when they make up cluster 1
+    t, diff = feature_t_stats(X[60:], n, sum_all, sumsq_all, const_all)
+    assert t.shape == (1,)
@@ -7,6 +7,52 @@ from scipy import stats
 from sklearn.metrics import calinski_harabasz_score as CH_score
 from mpmath import mp
 
+
+def _split_stats(y, indices1, parent_stats, y_sum):
+    """Compute the discrimination scores and standard deviations of a split.
+
+    Only the samples of the second cluster are read. The sum and sum of
+    squares of the first cluster are derived from those of the parent
+    cluster, and the mean of the samples outside a cluster is derived from
+    the precomputed sum over the whole dataset.
+
+    Parameters
+    ----------
+    y : ndarray of shape (n_samples,)
+        Metric values, shifted so that they have no large offset.
+    indices1 : ndarray
+        Indices of the samples in the second cluster.
+    parent_stats : tuple of (int, float, float)
+        Size, sum and sum of squares of the metric in the parent cluster.
+    y_sum : float
+        Sum of the metric values over all samples.
+
+    Returns
+    -------
+    score0, score1 : float
+        Discrimination scores of the first and the second cluster.
+    std0, std1 : float
+        Standard deviations of the metric in the first and the second cluster.
+    stats0, stats1 : tuple of (int, float, float)
+        Size, sum and sum of squares of the metric in the first and the second cluster.
+    """
+    n_samples = y.shape[0]
+    n, total, total_sq = parent_stats
+    y1 = y[indices1]
+    n1 = y1.shape[0]
+    # Sums are accumulated in float64, also when y is stored as float32
+    sum1 = y1.sum(dtype=np.float64)
+    sumsq1 = np.einsum("i,i->", y1, y1, dtype=np.float64)
+    n0, sum0, sumsq0 = n - n1, total - sum1, total_sq - sumsq1
+    mean0 = sum0 / n0
+    mean1 = sum1 / n1
+    score0 = (y_sum - sum0) / (n_samples - n0) - mean0
+    score1 = (y_sum - sum1) / (n_samples - n1) - mean1
+    std0 = np.sqrt(max(sumsq0 / n0 - mean0**2, 0))
+    std1 = np.sqrt(max(sumsq1 / n1 - mean1**2, 0))
+    return score0, score1, std0, std1, (n0, sum0, sumsq0), (n1, sum1, sumsq1)
+
+
 class BiasAwareHierarchicalClustering(ABC, BaseEstimator, ClusterMixin):
     """
     Base class for Bias-Aware Hierarchical Clustering.
@@ -33,17 +79,29 @@ class BiasAwareHierarchicalClustering(ABC, BaseEstimator, ClusterMixin):
             List of n_features-dimensional data points. Each row
             corresponds to a single data point.
         y : array-like of shape (n_samples)
-            Metric values.
+            Metric values. They are stored as float32 if X is passed as float32.
 
         Returns
         -------
         self : object
             Fitted estimator.
         """
+        # Only float32 data passed by the caller keeps y in float32; validation also
+        # casts e.g. integer X to float32, which should not reduce the precision of y
+        float32_input = getattr(X, "dtype", None) == np.float32
         X, y = self._validate_data(
             X, y, reset=False, accept_large_sparse=False, dtype=self._dtype, order="C"
         )
+        if float32_input:
+            # The splits are dominated by reading y, so we keep it in the precision of X;
+            # the sums over y are still accumulated in float64
+            y = y.astype(np.float32, copy=False)
         n_samples, _ = X.shape
+        # The scores and stds do not depend on a shift of y, so we shift it by its first value;
+        # the sums of squares then do not cancel catastrophically for metrics with a large offset
+        y = y - y[0]
+        # The sum of the metric over all samples is needed for the scores of every split
+        y_sum = y.sum(dtype=np.float64)
         # We start with all samples in a single cluster
         self.n_clusters_ = 1
         # We assign all samples a label of zero
@@ -53,14 +111,16 @@ class BiasAwareHierarchicalClustering(ABC, BaseEstimator, ClusterMixin):
         label = 0
         # The entire dataset has a discrimination score of zero
         score = 0
-        heap = [(None, label, score)]
+        # Heap entries also hold the indices of the samples in the cluster, and the size,
+        # sum and sum of squares of their metric values, so that neither has to be
+        # recomputed from scratch when the cluster is split
+        heap = [(None, label, score, np.arange(n_samples), (n_samples, y_sum, np.einsum("i,i->", y, y, dtype=np.float64)))]
         for _ in range(self.n_iter):
             if not heap:
                 # If the heap is empty we stop iterating
                 break
             # Take the cluster with the highest standard deviation of metric y
-            _, label, score = heapq.heappop(heap)
-            cluster_indices = np.nonzero(labels == label)[0]
+            _, label, score, cluster_indices, cluster_stats = heapq.heappop(heap)
             cluster = X[cluster_indices]
             cluster_labels = self._split(cluster)
             indices0 = cluster_indices[np.nonzero(cluster_labels == 0)[0]]
@@ -70,19 +130,15 @@ class BiasAwareHierarchicalClustering(ABC, BaseEstimator, ClusterMixin):
                 and len(indices1) >= self.min_cluster_size
             ):
                 # We calculate the discrimination scores using formula (1) in [1]
-                mask0 = np.ones(n_samples, dtype=bool)
-                mask0[indices0] = False
-                score0 = np.mean(y[mask0]) - np.mean(y[indices0])
-                mask1 = np.ones(n_samples, dtype=bool)
-                mask1[indices1] = False
-                score1 = np.mean(y[mask1]) - np.mean(y[indices1])
+                score0, score1, std0, std1, stats0, stats1 = _split_stats(
+                    y, indices1, cluster_stats, y_sum
+                )
                 if max(score0, score1) >= score:
                     # heapq implements min-heap
                     # so we have to negate std before pushing
-                    std0 = np.std(y[indices0])
-                    heapq.heappush(heap, (-std0, label, score0))
-                    std1 = np.std(y[indices1])
-                    heapq.heappush(heap, (-std1, self.n_clusters_, score1))
+                    # labels are unique, so the indices and stats are never compared
+                    heapq.heappush(heap, (-std0, label, score0, indices0, stats0))
+                    heapq.heappush(heap, (-std1, self.n_clusters_, score1, indices1, stats1))
                     labels[indices1] = self.n_clusters_
                     self.n_clusters_ += 1
                 else:
@@ -91,13 +147,14 @@ class BiasAwareHierarchicalClustering(ABC, BaseEstimator, ClusterMixin):
             else:
                 clusters.append(label)
                 scores.append(score)
-        clusters = np.array(clusters + [label for _, label, _ in heap])
-        scores = np.array(scores + [score for _, _, score in heap])
+        clusters = np.array(clusters + [label for _, label, _, _, _ in heap])
+        scores = np.array(scores + [score for _, _, score, _, _ in heap])
         # We sort clusters by decreasing scores
         indices = np.argsort(-scores)
         clusters = clusters[indices]
         self.scores_ = scores[indices]
-        mapping = np.zeros(self.n_clusters_, dtype=np.uint32)
+        # clusters holds every label exactly once, so each entry of the mapping is set
+        mapping = np.empty(self.n_clusters_, dtype=np.uint32)
         mapping[clusters] = np.arange(self.n_clusters_, dtype=np.uint32)
         self.labels_ = mapping[labels]
 
@@ -81,17 +81,16 @@ class BiasAwareHierarchicalKMeans(BiasAwareHierarchicalClustering):
         
         """
 
-        # create an array of (d, k) with d being the number of features and k the number of unique labels
-        centroids = np.zeros((X.shape[1], len(np.unique(labels))))
+        # labels are 0, ..., k-1, with k the number of clusters
+        n_clusters = labels.max() + 1
 
-        # iterate over the labels
-        for i, label in enumerate(np.unique(labels)):
+        # accumulate the sum and the number of data points per cluster in a single pass over X
+        sums = np.zeros((n_clusters, X.shape[1]))
+        np.add.at(sums, labels, X)
+        counts = np.bincount(labels, minlength=n_clusters)
 
-            # get the data points that belong to the cluster with the current label
-            X_label = X[labels == label]
-
-            # calculate the mean of the data points
-            centroids[:, i] = np.mean(X_label, axis=0)
+        # create an array of (d, k) with d being the number of features, holding the mean per cluster
+        centroids = (sums / counts[:, None]).T
 
         return centroids
     
@@ -114,24 +113,16 @@ class BiasAwareHierarchicalKMeans(BiasAwareHierarchicalClustering):
         X = self._validate_data(
             X, reset=False, accept_large_sparse=False, dtype=self._dtype, order="C"
         )
-        # Get dimensions
-        n_samples = X.shape[0]
-        n_clusters = self.centroids_.shape[1]
-        
-        # Initialize distance matrix
-        distances = np.zeros((n_samples, n_clusters))
-        
-        # Compute squared Euclidean distance between each sample and each centroid
-        for k in range(n_clusters):
-
-            # get the centroid
-            centroid_k = self.centroids_[:, k].T
-
-            # Deduct the centroid from the data
-            diff = X - centroid_k
-
-            # Calculate the sum of squared differences
-            distances[:, k] = np.sum(diff * diff, axis=1)
+        # Compute squared Euclidean distance between each sample and each centroid,
+        # using ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2 so that a single matrix product is needed.
+        # Both are shifted by the mean of the centroids first, as the expansion cancels
+        # catastrophically for features with a large offset relative to their spread.
+        # ||x||^2 is the same for every centroid, so it is left out of the argmin.
+        c_ref = self.centroids_.mean(axis=1)
+        X_c = X - c_ref
+        centroids_c = self.centroids_ - c_ref[:, None]
+        centroids_sq = np.einsum("ij,ij->j", centroids_c, centroids_c)[None, :]
+        distances = centroids_sq - 2 * (X_c @ centroids_c)
         
         # Get the index (label) of the closest centroid for each sample
         labels = np.argmin(distances, axis=1)